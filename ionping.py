@@ -1,233 +1,447 @@
-"""
-Created by Advait Menon
-Version 0.9
-Last Updated: 2023-04-10
-"""
-import os
-import socket
-import struct
-import ipaddress
-import time
-import argparse
-import argcomplete
-from concurrent import futures
-import sys
-from queue import Queue
-from threading import Thread
-
-"""
-Input file format example:
-192.168.0.0/16;
-172.16.0.0/12;
-10.0.0.0/8;1,2,3,10,100,254
-"""
-
-# ICMP ECHO REQUEST / REPLY CONSTANTS
-_header_byte_order = "!BBHHH"
-_ECHO_REQ = 8
-
-# Default Settings
-_default_timeout = 2.0
-_max_threads = 4
-timeout = _default_timeout
-
-# Queue for handling write requests from multiple threads
-writer_queue = Queue()
-
-"""
-
-ECHO REQUEST AND REPLY STRUCTURE
-
-   0                   1                   2                   3
-    0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
-   +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
-   |     Type      |     Code      |          Checksum             |
-   +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
-   |           Identifier          |        Sequence Number        |
-   +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
-   |     Data ...
-   +-+-+-+-+-
-"""
-
-"""
-build a payload for requests. Default Data is blank. It's best left this way to avoid IDS from mistaking it for a 
-C2 Beacon
-"""
-
-
-class ICMP_ECHO():
-    def __init__(self, icmp_id=0, sequence=0, data=b''):
-        self.icmp_id = icmp_id
-        self.sequence = sequence
-        self.data = data
-        icmp_header = struct.pack(_header_byte_order, _ECHO_REQ, 0, 0, self.icmp_id, self.sequence)
-        payload = icmp_header + data
-        checksum = 0
-        for i in range(0, len(payload), 2):
-            word = (payload[i] << 8) + payload[i + 1]
-            checksum += word
-            checksum = (checksum & 0xffff) + (checksum >> 16)
-        self.checksum = ~checksum & 0xffff
-        # self.checksum = self.calculate_checksum(icmp_header + self.data)
-        self.header = struct.pack(_header_byte_order, _ECHO_REQ, 0, self.checksum, self.icmp_id, self.sequence)
-        self.payload = self.header + self.data
-
-    def payload(self):
-        return self.header + self.data
-
-    def __str__(self):
-        return f'ICMP ECHO REQUEST: Checksum: {self.checksum}, ID: {self.icmp_id}, Sequence Number: {self.sequence}, Data: {self.data}'
-
-    def __repr__(self):
-        return f'{self.__class__.__name__}({self.checksum!r}, {self.icmp_id!r}, {self.sequence!r}, {self.data!r}'
-
-    def __len__(self):
-        return len(self.header + self.data)
-
-
-# Check if response matches expected format and address
-def validate_echo_response(icmp_response, icmp_id, address):
-    type, code, checksum, id, seq = struct.unpack(_header_byte_order, icmp_response)
-    if type == 0 and code == 0 and id == icmp_id:
-        return True
-    else:
-        return False
-
-
-# Code to ping scan one subnet. Short circuits if a match is found.
-def subnet_queue(subnet, suffix_list):
-    if suffix_list is None:
-        suffix_list = [f'.{i}' for i in range(256)]
-    print(f'[i] Scanning Subnet: {subnet}')
-    try:
-        if "/" in subnet:  # Assume it's /24 and strip it
-            subnet = subnet.split("/")[0]
-        for suffix in suffix_list:
-            address = '.'.join(subnet.split(".")[0:-1]) + suffix
-            if send_ping(address):
-                print(f'[+] Subnet {subnet}/24 is live')
-                writer_queue.put(f'{subnet}/24\n')
-                break # If a match is found, stop doing more scans of the same subnet
-            # Check if at last value in subnet
-            if suffix == suffix_list[:-1]:
-                print(f'[-] Subnet {subnet}/24 is not live')
-    except KeyboardInterrupt:
-        sys.exit(1)
-
-
-# Code to send a ping and return if a response has been received.
-def send_ping(address):
-    icmp_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
-    icmp_socket.settimeout(_default_timeout)
-    echo_request = ICMP_ECHO()
-    icmp_socket.sendto(echo_request.payload, (address, 0))
-
-    start_time = time.time()
-    while True:
-        try:
-            packet, addr = icmp_socket.recvfrom(1024)
-            icmp_header = packet[20:28]
-            if validate_echo_response(icmp_header, echo_request.icmp_id, addr):
-                print(f'[+] Received ICMP response from {addr}/n')
-                return True
-            else:
-                print(f'[!] Received Unexpected response from {addr}/n')
-                print(icmp_header)
-                return False
-        except socket.timeout:
-            # Handle timeout error
-            elapsed_time = time.time() - start_time
-            if elapsed_time >= _default_timeout:
-                print(f'[-]Timeout waiting for ICMP response from {address}/n')
-                return False
-
-
-# Thread to write stuff in queue. Writes in real time in case the program is interrupted / crashes
-def file_writer(queue, file_handle):
-    while True:
-        output = writer_queue.get()
-        file_handle.write(output)
-        file_handle.flush()
-        writer_queue.task_done()
-
-
-def main():
-    # Argument Parsing
-    parser = argparse.ArgumentParser(description='A Python program to perform a ping scan.')
-    parser.add_argument('-iL', '--subnet-list', nargs='+', required=True, help='Input file for subnet and port mapping')
-    parser.add_argument('-o', '--output', nargs='+', required=True, help='Output txt file')
-    parser.add_argument('-t', '--timeout', help='Timeout duration in seconds (Default 0.8 seconds)', type=float, default=0.8)
-    parser.add_argument('-T', '--threads', help='Number of threads to run (Default 4 threads)', type=int, default=4)
-    argcomplete.autocomplete(parser)  # argcomplete
-    args = parser.parse_args()
-    args.subnet_list = ' '.join(args.subnet_list)
-    args.output = ' '.join(args.output)
-
-
-    if args.timeout <= 0:
-        print(f'[e] Specified timeout must be greater than zero')
-        exit(1)
-
-    if args.threads < 1:
-        print(f'[e] must use at least 1 thread')
-        exit(1)
-
-    if args.threads > _max_threads:
-        print(f'[e] thread size cannot be bigger than {_max_threads}! (Can cause serious issues)')
-        exit(1)
-
-    if not os.path.exists(args.subnet_list):
-        print(f'[e] File {args.subnet_list} could not be found.')
-        exit(1)
-
-    # Set arguments
-    file_name = args.output
-    global timeout
-    timeout = args.timeout
-
-    # Output file name adjustments
-    if os.path.splitext(file_name)[-1] != '.txt':
-        print(f'[w] Specified output \'{file_name}\' does not end in .txt. .txt will be automatically appended')
-        file_name = file_name + '.txt'
-
-    if os.path.exists(file_name):  # if file name exists add a (1) to it
-        n = 1
-        while os.path.exists(f'{os.path.splitext(file_name)[0]}({n}){os.path.splitext(file_name)[1]}'):
-            n += 1
-        print(
-            f'[w] {file_name} exists already. Writing to {os.path.splitext(file_name)[0]}({n}){os.path.splitext(file_name)[1]}')
-        file_name = f'{os.path.splitext(file_name)[0]}({n}){os.path.splitext(file_name)[1]}'
-
-    # Read and parse the input mapping
-    parsing_map = open(args.subnet_list, 'r').read().splitlines()
-    subnet_list = []  # The list of arguments to pass to the subnet_queue function. It's a tuple
-    for mapping in parsing_map:
-        cidr_range = mapping.split(";")[0]
-        host_range = 0
-        if mapping.split(";")[1] == "" or mapping.split(";")[1] is None: # If hosts aren't specified just default to all
-            host_range = [f".{i}" for i in range(256)]
-        else:
-            host_range = [f".{i}" for i in mapping.split(";")[1].split(",")]
-
-        # Convert list to
-        subnet_list.extend([(str(ipaddress.IPv4Network(ip)), host_range) for ip in
-                            ipaddress.ip_network(cidr_range).subnets(new_prefix=24)])
-
-    # Thread Handling
-    with open(file_name, 'a', encoding='utf-8') as handle:
-        # Establish a thread that processes write requests from the queue to output to file
-        writer = Thread(target=file_writer, args=(writer_queue, handle), daemon=True)
-        writer.start()
-        workers = min(args.threads, len(subnet_list))  # If the list of subnets is shorter, use that amount of threads instead
-        with futures.ThreadPoolExecutor(workers) as executor:  # run everything
-            executor.map(lambda p: subnet_queue(*p), subnet_list)  # The lambda passes unpacked tuple into subnet_queue
-        # Close the writing thread
-        writer_queue.join()
-    print('[i] finished execution')
-
-
-if __name__ == '__main__':
-    try:
-        main()
-    except KeyboardInterrupt:
-        sys.exit(1)
+"""
+Created by Advait Menon
+Version 0.9
+Last Updated: 2023-04-10
+"""
+import os
+import array
+import ctypes
+import socket
+import struct
+import ipaddress
+import itertools
+import collections
+import pathlib
+import asyncio
+import argparse
+import argcomplete
+import sys
+
+"""
+Input file format example:
+192.168.0.0/16;
+172.16.0.0/12;
+10.0.0.0/8;1,2,3,10,100,254
+"""
+
+# ICMP ECHO REQUEST / REPLY CONSTANTS
+_header_byte_order = "!BBHHH"
+_icmp_header = struct.Struct(_header_byte_order)  # Compiled once; re-parsing the format per call is wasted work
+_ECHO_REQ = 8
+
+# Default Settings
+_default_timeout = 2.0
+_default_concurrency = 256  # Concurrent subnet scans; probes are I/O-bound so this can sit well above CPU count
+timeout = _default_timeout
+
+# All probes share one raw socket, so replies are demultiplexed by ICMP id + sequence.
+# The id is constant per process and the sequence number is unique per probe.
+_icmp_id = os.getpid() & 0xffff
+_sequence_counter = itertools.count(1)
+_recv_buffer_size = 1 << 20
+
+# In-flight probes, keyed by sequence number. The reader callback resolves the future
+# when the matching echo reply arrives.
+_pending_probes = {}
+
+# Default host ids for a full /24 sweep, built once and shared by every subnet
+_all_host_ids = tuple(range(256))
+
+"""
+
+ECHO REQUEST AND REPLY STRUCTURE
+
+   0                   1                   2                   3
+    0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
+   +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+   |     Type      |     Code      |          Checksum             |
+   +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+   |           Identifier          |        Sequence Number        |
+   +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+   |     Data ...
+   +-+-+-+-+-
+"""
+
+"""
+build a payload for requests. Default Data is blank. It's best left this way to avoid IDS from mistaking it for a 
+C2 Beacon
+"""
+
+
+class ICMP_ECHO():
+    def __init__(self, icmp_id=0, sequence=0, data=b''):
+        self.icmp_id = icmp_id
+        self.sequence = sequence
+        self.data = data
+        icmp_header = _icmp_header.pack(_ECHO_REQ, 0, 0, self.icmp_id, self.sequence)
+        payload = icmp_header + data
+        if len(payload) % 2:  # pad to a whole number of 16-bit words
+            payload += b'\x00'
+        # Sum the payload as 16-bit big-endian words in one C-level pass instead of
+        # a Python loop per word, then fold the carries back in
+        words = array.array('H', payload)
+        if sys.byteorder == 'little':
+            words.byteswap()
+        checksum = sum(words)
+        checksum = (checksum & 0xffff) + (checksum >> 16)
+        checksum = (checksum & 0xffff) + (checksum >> 16)
+        self.checksum = ~checksum & 0xffff
+        self.header = _icmp_header.pack(_ECHO_REQ, 0, self.checksum, self.icmp_id, self.sequence)
+        self.payload = self.header + self.data
+
+    def payload(self):
+        return self.header + self.data
+
+    def __str__(self):
+        return f'ICMP ECHO REQUEST: Checksum: {self.checksum}, ID: {self.icmp_id}, Sequence Number: {self.sequence}, Data: {self.data}'
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.checksum!r}, {self.icmp_id!r}, {self.sequence!r}, {self.data!r}'
+
+    def __len__(self):
+        return len(self.header + self.data)
+
+
+# The echo request carries no data, so the packet is just the 8-byte header and only
+# the sequence number (and thus the checksum) changes per probe. Fold the constant
+# type/id part of the checksum once at import and pack headers directly, instead of
+# building a full ICMP_ECHO object per probe.
+_checksum_base = (_ECHO_REQ << 8) + _icmp_id
+_checksum_base = (_checksum_base & 0xffff) + (_checksum_base >> 16)
+
+
+def _build_echo_request(sequence):
+    checksum = _checksum_base + sequence
+    checksum = (checksum & 0xffff) + (checksum >> 16)
+    checksum = (checksum & 0xffff) + (checksum >> 16)
+    return _icmp_header.pack(_ECHO_REQ, 0, ~checksum & 0xffff, _icmp_id, sequence)
+
+
+# Check if response matches expected format and probe id / sequence number
+def validate_echo_response(icmp_response, icmp_id, sequence):
+    type, code, checksum, id, seq = _icmp_header.unpack(icmp_response)
+    if type == 0 and code == 0 and id == icmp_id and seq == sequence:
+        return True
+    else:
+        return False
+
+
+# ctypes mirrors of the iovec/msghdr/mmsghdr structs used by sendmmsg(2)
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_iovec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr), ('msg_len', ctypes.c_uint)]
+
+
+try:
+    _sendmmsg = ctypes.CDLL(None, use_errno=True).sendmmsg
+except (OSError, AttributeError):
+    _sendmmsg = None  # Not glibc/Linux; fall back to one sendto per probe
+
+
+# Pack a sockaddr_in from 4 network-order address bytes (family is host order, port is unused)
+def _pack_sockaddr(address_bytes):
+    return struct.pack('=H2s4s8x', socket.AF_INET, b'\x00\x00', address_bytes)
+
+
+# Mark a registered probe whose request could not be sent. Its waiter picks the error
+# up immediately and reports the host unanswered instead of sitting out the timeout
+def _fail_probe(sequence, error):
+    future = _pending_probes.get(sequence)
+    if future is not None and not future.done():
+        future.set_exception(error)
+
+
+# Send one echo request, charging any send failure (broadcast address, unroutable
+# range, full send buffer) to that probe alone rather than letting it propagate
+def _sendto_probe(icmp_socket, sequence, packet, address):
+    try:
+        icmp_socket.sendto(packet, (address, 0))
+    except OSError as error:
+        _fail_probe(sequence, error)
+
+
+# Send a batch of echo requests in as few syscalls as possible. probes is a list of
+# (sequence, packet, address, sockaddr) tuples with the sockaddr already packed, so
+# the send path does no address parsing; with sendmmsg available the whole subnet goes
+# to the kernel in one call instead of 256. Destinations the kernel refuses (e.g. the
+# local broadcast address raises EACCES) fail only their own probe.
+def _send_probes(icmp_socket, probes):
+    if _sendmmsg is None:
+        for sequence, packet, address, sockaddr in probes:
+            _sendto_probe(icmp_socket, sequence, packet, address)
+        return
+    count = len(probes)
+    packets = [ctypes.create_string_buffer(packet, len(packet)) for sequence, packet, address, sockaddr in probes]
+    names = [ctypes.create_string_buffer(sockaddr, 16) for sequence, packet, address, sockaddr in probes]
+    iovecs = (_iovec * count)()
+    headers = (_mmsghdr * count)()
+    for i, packet_buffer in enumerate(packets):
+        iovecs[i].iov_base = ctypes.addressof(packet_buffer)
+        iovecs[i].iov_len = len(probes[i][1])
+        headers[i].msg_hdr.msg_name = ctypes.addressof(names[i])
+        headers[i].msg_hdr.msg_namelen = 16
+        headers[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+        headers[i].msg_hdr.msg_iovlen = 1
+    sent = 0
+    while sent < count:
+        result = _sendmmsg(icmp_socket.fileno(), ctypes.byref(headers[sent]), count - sent, 0)
+        if result < 0:
+            # sendmmsg only reports an error when the first unsent message fails, so
+            # fail that one probe and carry on with the rest of the batch. Systemic
+            # errors (e.g. seccomp blocking the syscall) fail probes one by one, which
+            # still terminates and keeps the errors attributed to probes
+            errno_value = ctypes.get_errno()
+            _fail_probe(probes[sent][0], OSError(errno_value, os.strerror(errno_value)))
+            sent += 1
+        else:
+            sent += result
+
+
+# Code to ping scan one subnet. Short circuits if a match is found.
+# subnet is an ipaddress.IPv4Network (/24); host_ids are the final-octet values to probe
+async def subnet_queue(icmp_socket, handle, subnet, host_ids):
+    if host_ids is None:
+        host_ids = _all_host_ids
+    print(f'[i] Scanning Subnet: {subnet}')
+    base = int(subnet.network_address)
+    # Register every probe first, push the whole batch to the kernel in one
+    # sendmmsg call, then wait; a dead subnet costs one timeout, not one per host.
+    # Addresses come straight from the network base + host id, so the hot path never
+    # parses a dotted quad; the string form is only made for logging and the fallback
+    batch = []
+    probes = []
+    for host in host_ids:
+        address_bytes = (base + host).to_bytes(4, 'big')
+        address = socket.inet_ntoa(address_bytes)
+        sequence, future = _register_probe()
+        batch.append((sequence, _build_echo_request(sequence), address, _pack_sockaddr(address_bytes)))
+        probes.append(asyncio.ensure_future(_wait_probe(sequence, future, address)))
+    _send_probes(icmp_socket, batch)
+    live = False
+    for probe in asyncio.as_completed(probes):
+        if await probe:
+            live = True
+            break # If a match is found, stop waiting on the rest of the subnet
+    for probe in probes:
+        probe.cancel()
+    await asyncio.gather(*probes, return_exceptions=True)
+    if live:
+        print(f'[+] Subnet {subnet} is live')
+        # All writes happen on the event-loop thread, so no lock or queue is needed.
+        # Flush per result so output survives an interrupt / crash
+        handle.write(f'{subnet}\n')
+        handle.flush()
+    else:
+        print(f'[-] Subnet {subnet} is not live')
+
+
+# setsockopt option for attaching a classic BPF program (Linux; not in the socket module)
+_SO_ATTACH_FILTER = 26
+
+
+# Attach a classic BPF program so the kernel only queues echo replies carrying our
+# ICMP id. Without it every ICMP packet on the host (unrelated replies, unreachables,
+# redirects) wakes the event loop just to be dropped in Python. The raw socket hands
+# us the IP header too, so the program indexes off the IP header length:
+#
+#   ldxb 4*([0]&0xf)        X = IP header length
+#   ldb  [x+0]              A = ICMP type
+#   jne  #0, drop           keep echo replies only
+#   ldh  [x+4]              A = ICMP id
+#   jne  #_icmp_id, drop    keep our id only
+#   ret  #0xffff            accept
+#   drop: ret #0
+def _attach_reply_filter(icmp_socket):
+    instructions = [
+        (0xb1, 0, 0, 0),
+        (0x50, 0, 0, 0),
+        (0x15, 0, 3, 0),
+        (0x48, 0, 0, 4),
+        (0x15, 0, 1, _icmp_id),
+        (0x06, 0, 0, 0xffff),
+        (0x06, 0, 0, 0),
+    ]
+    filters = b''.join(struct.pack('HBBI', *instruction) for instruction in instructions)
+    buffer = ctypes.create_string_buffer(filters, len(filters))
+    fprog = struct.pack('HL', len(instructions), ctypes.addressof(buffer))
+    icmp_socket.setsockopt(socket.SOL_SOCKET, _SO_ATTACH_FILTER, fprog)
+
+
+# Build the shared raw ICMP socket. One socket serves every probe, so the kernel only
+# has to deliver each incoming ICMP packet once instead of to a socket per probe.
+def create_icmp_socket():
+    icmp_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+    icmp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, _recv_buffer_size)
+    icmp_socket.setblocking(False)
+    try:
+        _attach_reply_filter(icmp_socket)
+    except OSError:
+        pass  # Non-Linux or filter rejected; validate_echo_response still filters in userspace
+    return icmp_socket
+
+
+# Reader callback for the event loop: drain every reply the kernel has queued and
+# resolve the futures of whichever in-flight probes they belong to. Draining matters
+# because one epoll wakeup can carry many replies when a whole subnet answers at once;
+# stray packets are dropped.
+def _on_icmp_reply(icmp_socket):
+    while True:
+        try:
+            packet, addr = icmp_socket.recvfrom(1024)
+        except (BlockingIOError, InterruptedError):
+            return
+        icmp_header = packet[20:28]
+        type, code, checksum, id, seq = _icmp_header.unpack(icmp_header)
+        future = _pending_probes.get(seq)
+        if future is not None and not future.done() and validate_echo_response(icmp_header, _icmp_id, seq):
+            future.set_result(addr[0])
+
+
+# Claim a sequence number and register its future so the reply callback can find it.
+# Sequence numbers are 16-bit, so the counter wraps; skip values whose probe is still
+# in flight instead of silently orphaning it, and fail loudly if every value is taken
+def _register_probe():
+    if len(_pending_probes) >= 0x10000:
+        raise RuntimeError('all 65536 ICMP sequence numbers are in flight; lower the concurrency')
+    sequence = next(_sequence_counter) & 0xffff
+    while sequence in _pending_probes:
+        sequence = next(_sequence_counter) & 0xffff
+    future = asyncio.get_running_loop().create_future()
+    _pending_probes[sequence] = future
+    return sequence, future
+
+
+# Wait out one registered probe and report whether its reply arrived in time
+async def _wait_probe(sequence, future, address):
+    try:
+        # wait_for runs off the loop's monotonic clock and honors the -t option;
+        # probes used to be pinned to _default_timeout regardless of what was passed
+        responder = await asyncio.wait_for(future, timeout)
+        print(f'[+] Received ICMP response from {responder}')
+        return True
+    except asyncio.TimeoutError:
+        print(f'[-] Timeout waiting for ICMP response from {address}')
+        return False
+    except OSError as error:
+        print(f'[-] Could not send probe to {address}: {error}')
+        return False
+    finally:
+        # Only drop the entry if it is still ours; after a sequence wrap the slot may
+        # already belong to a newer probe
+        if _pending_probes.get(sequence) is future:
+            del _pending_probes[sequence]
+
+
+# Code to send a single ping and return if a response has been received.
+async def send_ping(icmp_socket, address):
+    sequence, future = _register_probe()
+    _sendto_probe(icmp_socket, sequence, _build_echo_request(sequence), address)
+    return await _wait_probe(sequence, future, address)
+
+
+# Drive the whole scan on one event loop: register the shared socket with the loop's
+# selector, then let a fixed pool of workers drain the subnet queue. Workers pull from
+# a shared deque instead of spawning a task per subnet up front, so memory stays flat
+# no matter how many /24s the input expands to.
+async def run_scan(icmp_socket, handle, subnet_list, concurrency):
+    loop = asyncio.get_running_loop()
+    loop.add_reader(icmp_socket.fileno(), _on_icmp_reply, icmp_socket)
+    work = collections.deque(subnet_list)
+
+    async def worker():
+        while work:  # Single-threaded loop, so check-then-pop cannot race
+            subnet, host_ids = work.popleft()
+            try:
+                await subnet_queue(icmp_socket, handle, subnet, host_ids)
+            except Exception as error:
+                # One subnet's failure must not tear down the other workers
+                print(f'[e] Scan of subnet {subnet} failed: {error}')
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        loop.remove_reader(icmp_socket.fileno())
+
+
+def main():
+    # Argument Parsing
+    parser = argparse.ArgumentParser(description='A Python program to perform a ping scan.')
+    parser.add_argument('-iL', '--subnet-list', nargs='+', required=True, help='Input file for subnet and port mapping')
+    parser.add_argument('-o', '--output', nargs='+', required=True, help='Output txt file')
+    parser.add_argument('-t', '--timeout', help='Timeout duration in seconds (Default 0.8 seconds)', type=float, default=0.8)
+    parser.add_argument('-T', '--threads', help='Number of subnets to scan concurrently (Default: up to 256, bounded by the subnet count)', type=int, default=None)
+    argcomplete.autocomplete(parser)  # argcomplete
+    args = parser.parse_args()
+    args.subnet_list = ' '.join(args.subnet_list)
+    args.output = ' '.join(args.output)
+
+
+    if args.timeout <= 0:
+        print(f'[e] Specified timeout must be greater than zero')
+        exit(1)
+
+    if args.threads is not None and args.threads < 1:
+        print(f'[e] must use at least 1 thread')
+        exit(1)
+
+    if not os.path.exists(args.subnet_list):
+        print(f'[e] File {args.subnet_list} could not be found.')
+        exit(1)
+
+    # Set arguments
+    file_name = args.output
+    global timeout
+    timeout = args.timeout
+
+    # Output file name adjustments
+    if os.path.splitext(file_name)[-1] != '.txt':
+        print(f'[w] Specified output \'{file_name}\' does not end in .txt. .txt will be automatically appended')
+        file_name = file_name + '.txt'
+
+    if os.path.exists(file_name):  # if file name exists add a (1) to it
+        n = 1
+        while os.path.exists(f'{os.path.splitext(file_name)[0]}({n}){os.path.splitext(file_name)[1]}'):
+            n += 1
+        print(
+            f'[w] {file_name} exists already. Writing to {os.path.splitext(file_name)[0]}({n}){os.path.splitext(file_name)[1]}')
+        file_name = f'{os.path.splitext(file_name)[0]}({n}){os.path.splitext(file_name)[1]}'
+
+    # Read and parse the input mapping
+    parsing_map = pathlib.Path(args.subnet_list).read_text().splitlines()
+    subnet_list = []  # The list of arguments to pass to the subnet_queue function. It's a tuple
+    for mapping in parsing_map:
+        cidr_range, _, hosts = mapping.partition(";")  # Single scan instead of three splits
+        if hosts:
+            host_range = tuple(int(i) for i in hosts.split(","))
+        else:  # If hosts aren't specified just default to all
+            host_range = _all_host_ids
+        network = ipaddress.ip_network(cidr_range)
+        # Keep the IPv4Network objects; subnet_queue derives addresses from them directly
+        subnet_list.extend((subnet, host_range) for subnet in network.subnets(new_prefix=24))
+
+    # Run the scan
+    icmp_socket = create_icmp_socket()
+    with open(file_name, 'a', encoding='utf-8') as handle:
+        # Workers are coroutines on one loop, not OS threads, so the old hard cap of 4
+        # serves no purpose; bound by the subnet count so idle workers aren't spawned
+        workers = min(args.threads or _default_concurrency, len(subnet_list))
+        asyncio.run(run_scan(icmp_socket, handle, subnet_list, workers))  # run everything
+    icmp_socket.close()
+    print('[i] finished execution')
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)